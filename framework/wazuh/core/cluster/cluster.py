@@ -8,7 +8,7 @@ import logging
 import os.path
 import shutil
 import zlib
-from asyncio import wait_for
+from asyncio import to_thread, wait_for
 from functools import partial
 from operator import eq
 from os import listdir, path, remove, stat, walk
@@ -148,6 +148,8 @@ def walk_dir(dirname, recursive, files, excluded_files, excluded_extensions, get
     if previous_status is None:
         previous_status = {}
     walk_files = {}
+    # str.endswith() accepts a tuple, so all the extensions are checked in a single call.
+    excluded_extensions = tuple(excluded_extensions)
 
     full_dirname = path.join(common.WAZUH_PATH, dirname)
     # Get list of all files and directories inside 'full_dirname'.
@@ -157,7 +159,7 @@ def walk_dir(dirname, recursive, files, excluded_files, excluded_extensions, get
             if recursive or root_ == full_dirname:
                 for file_ in files_:
                     # If file is inside 'excluded_files' or file extension is inside 'excluded_extensions', skip over.
-                    if file_ in excluded_files or any([file_.endswith(ext) for ext in excluded_extensions]):
+                    if file_ in excluded_files or file_.endswith(excluded_extensions):
                         continue
                     try:
                         #  If 'all' files have been requested or entry is in the specified files list.
@@ -369,31 +371,71 @@ def compress_files(name, list_path, cluster_control_json=None, max_zip_size=None
     return zip_file_path
 
 
-async def async_decompress_files(zip_path, ko_files_name="files_metadata.json"):
+async def async_decompress_files(zip_path, ko_files_name="files_metadata.json", manifest_only=False):
     """Async wrapper for decompress_files() function.
 
+    The decompression is run in a separate thread so the event loop is not blocked meanwhile.
+
     Parameters
     ----------
     zip_path : str
         Full path to the zip file.
     ko_files_name : str
         Name of the metadata json inside zip file.
+    manifest_only : bool
+        Whether to load only the metadata json, without writing any file to disk.
 
     Returns
     -------
     ko_files : dict
         Paths (keys) and metadata (values) of the files listed in cluster.json.
-    zip_dir : str
-        Full path to unzipped directory.
+    zip_dir : str or None
+        Full path to unzipped directory. None if only the metadata json was loaded.
     """
-    return decompress_files(zip_path, ko_files_name)
+    return await to_thread(decompress_files, zip_path, ko_files_name, manifest_only)
 
 
-def decompress_files(compress_path, ko_files_name="files_metadata.json"):
-    """Decompress files in a directory and load the files_metadata.json as a dict.
+def iter_decompress_files(compress_path):
+    """Decompress, one by one, the files contained in a compress file.
 
     To avoid consuming too many memory resources, the compressed file is read in chunks
-    of 'windows_size' and split based on a file separator.
+    of 'windows_size' and split based on a file separator. Each file is decompressed only
+    when it is requested, so nothing is written to disk.
+
+    Parameters
+    ----------
+    compress_path : str
+        Full path to the compress file.
+
+    Yields
+    ------
+    filepath : str
+        Relative path of the compressed file.
+    content : bytes
+        Decompressed content of the file.
+    """
+    compressed_data = b''
+    window_size = 1024 * 1024 * 10  # 10 MiB
+
+    with open(compress_path, 'rb') as rf:
+        while True:
+            new_data = rf.read(window_size)
+            compressed_data += new_data
+            files = compressed_data.split(FILE_SEP.encode())
+            if new_data:
+                # If 'files' list contains only 1 item, it is probably incomplete, so it is not used.
+                compressed_data = files.pop(-1)
+
+            for file in files:
+                filepath, content = file.split(PATH_SEP.encode(), 1)
+                yield filepath.decode(), zlib.decompress(content)
+
+            if not new_data:
+                break
+
+
+def decompress_files(compress_path, ko_files_name="files_metadata.json", manifest_only=False):
+    """Decompress files in a directory and load the files_metadata.json as a dict.
 
     Parameters
     ----------
@@ -401,46 +443,45 @@ def decompress_files(compress_path, ko_files_name="files_metadata.json"):
         Full path to the compress file.
     ko_files_name : str
         Name of the metadata json inside the compress file.
+    manifest_only : bool
+        Whether to load only the metadata json, without writing any file to disk.
 
     Returns
     -------
     ko_files : dict
         Paths (keys) and metadata (values) of the files listed in cluster.json.
-    zip_dir : str
-        Full path to decompressed directory.
+    zip_dir : str or None
+        Full path to decompressed directory. None if only the metadata json was loaded.
     """
     ko_files = ''
-    compressed_data = b''
-    window_size = 1024 * 1024 * 10  # 10 MiB
+
+    if manifest_only:
+        try:
+            for filepath, content in iter_decompress_files(compress_path):
+                if filepath == ko_files_name:
+                    ko_files = json.loads(content)
+                    break
+        finally:
+            # Once read the metadata, remove the compress file.
+            remove(compress_path)
+
+        return ko_files, None
+
     decompress_dir = compress_path + 'dir'
 
     try:
         mkdir_with_mode(decompress_dir)
 
-        with open(compress_path, 'rb') as rf:
-            while True:
-                new_data = rf.read(window_size)
-                compressed_data += new_data
-                files = compressed_data.split(FILE_SEP.encode())
-                if new_data:
-                    # If 'files' list contains only 1 item, it is probably incomplete, so it is not used.
-                    compressed_data = files.pop(-1)
-
-                for file in files:
-                    filepath, content = file.split(PATH_SEP.encode(), 1)
-                    content = zlib.decompress(content)
-                    full_path = os.path.join(decompress_dir, filepath.decode())
-                    if not os.path.exists(os.path.dirname(full_path)):
-                        try:
-                            os.makedirs(os.path.dirname(full_path))
-                        except OSError as exc:  # Guard against race condition
-                            if exc.errno != errno.EEXIST:
-                                raise
-                    with open(full_path, 'wb') as f:
-                        f.write(content)
-
-                if not new_data:
-                    break
+        for filepath, content in iter_decompress_files(compress_path):
+            full_path = os.path.join(decompress_dir, filepath)
+            if not os.path.exists(os.path.dirname(full_path)):
+                try:
+                    os.makedirs(os.path.dirname(full_path))
+                except OSError as exc:  # Guard against race condition
+                    if exc.errno != errno.EEXIST:
+                        raise
+            with open(full_path, 'wb') as f:
+                f.write(content)
 
         if path.exists(path.join(decompress_dir, ko_files_name)):
             with open(path.join(decompress_dir, ko_files_name)) as ko:
@@ -1797,3 +1797,26 @@ def as_wazuh_object(dct: Dict):
         raise exception.WazuhInternalError(1000,
                                            extra_message=f"Wazuh object cannot be decoded from JSON {dct}",
                                            cmd_error=True)
+
+
+_UNSET_DATE = utils.get_date_from_timestamp(0)
+
+
+def health_json_default(obj: Any) -> Union[str, None]:
+    """Serialize the objects found in the cluster health information that JSON does not support.
+
+    Dates that have never been set are shown as 'n/a'.
+
+    Parameters
+    ----------
+    obj : Any
+        Object to be serialized.
+
+    Returns
+    -------
+    str or None
+        String representation of the date. None for any other object.
+    """
+    if isinstance(obj, datetime.datetime):
+        return "n/a" if obj == _UNSET_DATE else str(obj)
+    return None
@@ -246,8 +246,11 @@ class DistributedAPI:
         common.cluster_nodes.set(nodes)
         common.current_user.set(current_user)
         common.origin_module.set(origin_module)
-        data = f(**f_kwargs)
-        common.reset_context_cache()
+        try:
+            data = f(**f_kwargs)
+        finally:
+            # The process is reused by the next requests, so the cached results must not outlive this one
+            common.reset_context_cache()
         debug_log(logger, "Finished executing request locally")
         return data
 
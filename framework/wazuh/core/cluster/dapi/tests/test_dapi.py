@@ -533,6 +533,24 @@ def test_DistributedAPI_check_wazuh_status_exception(node_info_mock, status_valu
             assert e._extra_message['not_ready_daemons'] == extra_message
 
 
+@pytest.mark.parametrize('side_effect', [None, WazuhError(4000)])
+@patch('wazuh.core.cluster.dapi.dapi.common.reset_context_cache')
+def test_DistributedAPI_run_local(reset_context_cache_mock, side_effect):
+    """Test that `run_local` method from class DistributedAPI resets the context cache even if the function fails."""
+    f = MagicMock(return_value='data', side_effect=side_effect)
+    run_local_kwargs = {'f': f, 'f_kwargs': {'arg': 'value'}, 'logger': logger, 'rbac_permissions': {},
+                        'broadcasting': False, 'nodes': ['master'], 'current_user': 'wazuh', 'origin_module': 'API'}
+
+    if side_effect is None:
+        assert DistributedAPI.run_local(**run_local_kwargs) == 'data'
+    else:
+        with pytest.raises(WazuhError, match='.* 4000 .*'):
+            DistributedAPI.run_local(**run_local_kwargs)
+
+    f.assert_called_once_with(arg='value')
+    reset_context_cache_mock.assert_called_once_with()
+
+
 @patch("asyncio.Queue")
 def test_APIRequestQueue_init(queue_mock):
     """Test `APIRequestQueue` constructor."""
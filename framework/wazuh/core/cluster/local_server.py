@@ -7,7 +7,6 @@ import functools
 import json
 import os
 import random
-from datetime import datetime
 from typing import Tuple, Union
 
 import uvloop
@@ -17,7 +16,6 @@ from wazuh.core.cluster import common as c_common, server, client, cluster
 from wazuh.core.cluster.dapi import dapi
 from wazuh.core.cluster.utils import context_tag
 from wazuh.core.exception import WazuhClusterError
-from wazuh.core.utils import get_date_from_timestamp
 
 
 class LocalServerHandler(server.AbstractServerHandler):
@@ -305,9 +303,7 @@ class LocalServerHandlerMaster(LocalServerHandler):
             Dict object containing nodes information.
         """
         return b'ok', json.dumps(self.server.node.get_health(json.loads(filter_nodes)),
-                                 default=lambda o: "n/a" if
-                                 isinstance(o, datetime) and o == get_date_from_timestamp(0)
-                                 else (o.__str__() if isinstance(o, datetime) else None)).encode()
+                                 default=c_common.health_json_default).encode()
 
     def send_file_request(self, path, node_name):
         """Send a file from the API to the cluster.
@@ -2,21 +2,20 @@
 # Created by Wazuh, Inc. <info@wazuh.com>.
 # This program is free software; you can redistribute it and/or modify it under the terms of GPLv2
 import asyncio
-import functools
 import json
-import operator
 import os
 import shutil
 from calendar import timegm
 from collections import defaultdict
 from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 from time import perf_counter
 from typing import Tuple, Dict, Callable
 from uuid import uuid4
 
 from wazuh.core import cluster as metadata, common, exception, utils
-from wazuh.core.agent import Agent
+from wazuh.core.agent import WazuhDBQueryGroupByAgents
 from wazuh.core.cluster import server, cluster, common as c_common
 from wazuh.core.cluster.dapi import dapi
 from wazuh.core.cluster.utils import context_tag
@@ -25,6 +24,51 @@ from wazuh.core.utils import get_utc_now
 from wazuh.core.wdb import AsyncWazuhDBConnection
 
 
+def parse_merged_file_time(file_time: str) -> datetime:
+    """Get the modification time of a file inside a merged file.
+
+    The date is written by cluster.merge_info() as str(datetime), so the C implemented datetime.fromisoformat() can
+    parse it. The slower strptime is only used for dates that do not match that format.
+
+    Parameters
+    ----------
+    file_time : str
+        Modification time as written in the merged file header. I.e.: '2020-11-23 10:51:23.123456+00:00'.
+
+    Returns
+    -------
+    datetime
+        Modification time in UTC.
+    """
+    try:
+        return datetime.fromisoformat(file_time).replace(tzinfo=timezone.utc)
+    except ValueError:
+        try:
+            return utils.get_utc_strptime(file_time, '%Y-%m-%d %H:%M:%S.%f%z')
+        except ValueError:
+            return utils.get_utc_strptime(file_time, '%Y-%m-%d %H:%M:%S%z')
+
+
+@lru_cache(maxsize=1024)
+def format_keep_alive(timestamp: float) -> str:
+    """Format the last keep alive timestamp of a worker.
+
+    Workers send keep alives less often than the health information is usually requested, so the same timestamps are
+    formatted again and again. The result is cached to avoid it.
+
+    Parameters
+    ----------
+    timestamp : float
+        Last keep alive received from the worker, as a UNIX timestamp.
+
+    Returns
+    -------
+    str
+        Last keep alive date formatted with DECIMALS_DATE_FORMAT.
+    """
+    return utils.get_date_from_timestamp(timestamp).strftime(DECIMALS_DATE_FORMAT)
+
+
 class ReceiveIntegrityTask(c_common.ReceiveFileTask):
     """
     Define the process and variables necessary to receive and process integrity information from the master.
@@ -168,6 +212,33 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
     Handle incoming requests and sync processes with a worker.
     """
 
+    # Commands that can be received from a worker and the function in charge of each of them. Lambdas are used so
+    # methods are looked up in every call.
+    commands = {
+        b'syn_i_w_m_p': lambda self, command, data: self.get_permission(command),
+        b'syn_a_w_m_p': lambda self, command, data: self.get_permission(command),
+        b'syn_i_w_m': lambda self, command, data: self.setup_sync_integrity(command, data),
+        b'syn_e_w_m': lambda self, command, data: self.setup_sync_integrity(command, data),
+        b'syn_a_w_m': lambda self, command, data: self.setup_sync_integrity(command, data),
+        b'syn_w_g_c': lambda self, command, data: self.setup_send_info(command),
+        b'syn_i_w_m_e': lambda self, command, data: self.end_receiving_integrity_checksums(data.decode()),
+        b'syn_e_w_m_e': lambda self, command, data: self.end_receiving_integrity_checksums(data.decode()),
+        b'syn_i_w_m_r': lambda self, command, data: self.process_sync_error_from_worker(data),
+        b'syn_w_g_e': lambda self, command, data: c_common.end_sending_agent_information(
+            self.task_loggers['Agent-groups send'], self.send_agent_groups_status['date_start'], data.decode()),
+        b'syn_wgc_e': lambda self, command, data: c_common.end_sending_agent_information(
+            self.task_loggers['Agent-groups send full'], self.send_agent_groups_status['date_start'], data.decode()),
+        b'syn_w_g_err': lambda self, command, data: c_common.error_receiving_agent_information(
+            self.task_loggers['Agent-groups send'], data.decode(), info_type='agent-groups'),
+        b'syn_wgc_err': lambda self, command, data: c_common.error_receiving_agent_information(
+            self.task_loggers['Agent-groups send full'], data.decode(), info_type='agent-groups'),
+        b'dapi': lambda self, command, data: self.add_dapi_request(data),
+        b'dapi_res': lambda self, command, data: self.process_dapi_res(data),
+        b'get_nodes': lambda self, command, data: self.process_get_nodes(data),
+        b'get_health': lambda self, command, data: self.process_get_health(data),
+        b'sendsync': lambda self, command, data: self.add_sendsync_request(data),
+    }
+
     def __init__(self, **kwargs):
         """Class constructor.
 
@@ -198,6 +269,8 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
         self.version = ""
         self.cluster_name = ""
         self.node_type = ""
+        # Node name already encoded, used to tag every DAPI and SendSync request coming from the worker.
+        self.encoded_name = b""
         self.agent_group_task = None
         # Dictionary to save loggers for each sync task.
         self.task_loggers = {}
@@ -243,48 +316,83 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
             Response message.
         """
         self.logger.debug(f"Command received: {command}")
-        if command == b'syn_i_w_m_p' or command == b'syn_a_w_m_p':
-            return self.get_permission(command)
-        elif command == b'syn_i_w_m' or command == b'syn_e_w_m' or command == b'syn_a_w_m':
-            return self.setup_sync_integrity(command, data)
-        elif command == b'syn_w_g_c':
-            return self.setup_send_info(command)
-        elif command == b'syn_i_w_m_e' or command == b'syn_e_w_m_e':
-            return self.end_receiving_integrity_checksums(data.decode())
-        elif command == b'syn_i_w_m_r':
-            return self.process_sync_error_from_worker(data)
-        elif command == b'syn_w_g_e':
-            logger = self.task_loggers['Agent-groups send']
-            start_time = self.send_agent_groups_status['date_start']
-            return c_common.end_sending_agent_information(logger, start_time, data.decode())
-        elif command == b'syn_wgc_e':
-            logger = self.task_loggers['Agent-groups send full']
-            start_time = self.send_agent_groups_status['date_start']
-            return c_common.end_sending_agent_information(logger, start_time, data.decode())
-        elif command == b'syn_w_g_err':
-            logger = self.task_loggers['Agent-groups send']
-            return c_common.error_receiving_agent_information(logger, data.decode(), info_type='agent-groups')
-        elif command == b'syn_wgc_err':
-            logger = self.task_loggers['Agent-groups send full']
-            return c_common.error_receiving_agent_information(logger, data.decode(), info_type='agent-groups')
-        elif command == b'dapi':
-            self.server.dapi.add_request(self.name.encode() + b'*' + data)
-            return b'ok', b'Added request to API requests queue'
-        elif command == b'dapi_res':
-            return self.process_dapi_res(data)
-        elif command == b'get_nodes':
-            cmd, res = self.get_nodes(json.loads(data))
-            return cmd, json.dumps(res).encode()
-        elif command == b'get_health':
-            cmd, res = self.get_health(json.loads(data))
-            return cmd, json.dumps(
-                res, default=lambda o: "n/a" if isinstance(o, datetime) and o == utils.get_date_from_timestamp(0) else
-                (o.__str__() if isinstance(o, datetime) else None)).encode()
-        elif command == b'sendsync':
-            self.server.sendsync.add_request(self.name.encode() + b'*' + data)
-            return b'ok', b'Added request to SendSync requests queue'
-        else:
+        try:
+            process_command = self.commands[command]
+        except KeyError:
             return super().process_request(command, data)
+        return process_command(self, command, data)
+
+    def add_dapi_request(self, data: bytes) -> Tuple[bytes, bytes]:
+        """Add a request coming from the worker to the DAPI requests queue.
+
+        Parameters
+        ----------
+        data : bytes
+            Received payload.
+
+        Returns
+        -------
+        bytes
+            Result.
+        bytes
+            Response message.
+        """
+        self.server.dapi.add_request(self.encoded_name + b'*' + data)
+        return b'ok', b'Added request to API requests queue'
+
+    def add_sendsync_request(self, data: bytes) -> Tuple[bytes, bytes]:
+        """Add a request coming from the worker to the SendSync requests queue.
+
+        Parameters
+        ----------
+        data : bytes
+            Received payload.
+
+        Returns
+        -------
+        bytes
+            Result.
+        bytes
+            Response message.
+        """
+        self.server.sendsync.add_request(self.encoded_name + b'*' + data)
+        return b'ok', b'Added request to SendSync requests queue'
+
+    def process_get_nodes(self, data: bytes) -> Tuple[bytes, bytes]:
+        """Decode the 'get_nodes' arguments and encode its response.
+
+        Parameters
+        ----------
+        data : bytes
+            JSON encoded arguments for the get_nodes function.
+
+        Returns
+        -------
+        bytes
+            Result.
+        bytes
+            JSON encoded nodes information.
+        """
+        cmd, res = self.get_nodes(json.loads(data))
+        return cmd, json.dumps(res).encode()
+
+    def process_get_health(self, data: bytes) -> Tuple[bytes, bytes]:
+        """Decode the 'get_health' arguments and encode its response.
+
+        Parameters
+        ----------
+        data : bytes
+            JSON encoded node filter for the get_health function.
+
+        Returns
+        -------
+        bytes
+            Result.
+        bytes
+            JSON encoded health information.
+        """
+        cmd, res = self.get_health(json.loads(data))
+        return cmd, json.dumps(res, default=c_common.health_json_default).encode()
 
     async def execute(self, command: bytes, data: bytes, wait_for_complete: bool) -> Dict:
         """Send DAPI request and wait for response.
@@ -307,40 +415,45 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
             API response.
         """
         request_id = str(uuid4())
-        # Create an event to wait for the response.
-        self.server.pending_api_requests[request_id] = {'Event': asyncio.Event(), 'Response': ''}
-
-        # If forward request to other worker, get destination client and request.
-        if command == b'dapi_fwd':
-            client, request = data.split(b' ', 1)
-            client = client.decode()
-            if client in self.server.clients:
-                result = (await self.server.clients[client].send_request(b'dapi',
-                                                                         request_id.encode() + b' ' + request)).decode()
+        # Create a future to wait for the response.
+        self.server.pending_api_requests[request_id] = asyncio.get_running_loop().create_future()
+
+        try:
+            # If forward request to other worker, get destination client and request.
+            if command == b'dapi_fwd':
+                client, request = data.split(b' ', 1)
+                client = client.decode()
+                if client in self.server.clients:
+                    result = (await self.server.clients[client].send_request(b'dapi', request_id.encode() + b' ' +
+                                                                             request)).decode()
+                else:
+                    raise exception.WazuhClusterError(3022, extra_message=client)
+            # Add request to local API requests queue.
+            elif command == b'dapi':
+                result = (await self.send_request(b'dapi', request_id.encode() + b' ' + data)).decode()
+            # If not dapi related command, run it now.
             else:
-                raise exception.WazuhClusterError(3022, extra_message=client)
-        # Add request to local API requests queue.
-        elif command == b'dapi':
-            result = (await self.send_request(b'dapi', request_id.encode() + b' ' + data)).decode()
-        # If not dapi related command, run it now.
-        else:
-            result = self.process_request(command=command, data=data)
+                result = self.process_request(command=command, data=data)
+
+            # If command was dapi or dapi_fwd, wait for response.
+            if command == b'dapi' or command == b'dapi_fwd':
+                try:
+                    timeout = None if wait_for_complete \
+                        else self.cluster_items['intervals']['communication']['timeout_dapi_request']
+                    request_result = await asyncio.wait_for(self.server.pending_api_requests[request_id],
+                                                            timeout=timeout)
+                except asyncio.TimeoutError:
+                    raise exception.WazuhClusterError(3021)
+            # Otherwise, immediately return the result obtained before.
+            else:
+                status, request_result = result
+                if status != b'ok':
+                    raise exception.WazuhClusterError(3022, extra_message=request_result.decode())
+                request_result = request_result.decode()
+        finally:
+            # The request is no longer pending, whether it has been answered or not.
+            self.server.pending_api_requests.pop(request_id, None)
 
-        # If command was dapi or dapi_fwd, wait for response.
-        if command == b'dapi' or command == b'dapi_fwd':
-            try:
-                timeout = None if wait_for_complete \
-                    else self.cluster_items['intervals']['communication']['timeout_dapi_request']
-                await asyncio.wait_for(self.server.pending_api_requests[request_id]['Event'].wait(), timeout=timeout)
-                request_result = self.server.pending_api_requests[request_id]['Response']
-            except asyncio.TimeoutError:
-                raise exception.WazuhClusterError(3021)
-        # Otherwise, immediately return the result obtained before.
-        else:
-            status, request_result = result
-            if status != b'ok':
-                raise exception.WazuhClusterError(3022, extra_message=request_result.decode())
-            request_result = request_result.decode()
         return request_result
 
     def hello(self, data: bytes) -> Tuple[bytes, bytes]:
@@ -373,6 +486,7 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
 
         # Fill more information and check both name and version are correct.
         self.version, self.cluster_name, self.node_type = version.decode(), cluster_name.decode(), node_type.decode()
+        self.encoded_name = name
 
         if self.cluster_name != self.server.configuration['name']:
             raise exception.WazuhClusterError(3030)
@@ -407,8 +521,8 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
         This function is called when the master received a "dapi_res" command. The response
         has been previously sent using a send_string so this method only receives the string ID.
 
-        If the request ID is within the pending api requests, the response is assigned to the request ID and
-        the server is notified. Else, if the request ID is within the local_server clients, it is forwarded.
+        If the request ID is within the pending api requests, the response is set as the result of the request's
+        future. Else, if the request ID is within the local_server clients, it is forwarded.
 
         Parameters
         ----------
@@ -425,8 +539,10 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
         req_id, string_id = data.split(b' ', 1)
         req_id = req_id.decode()
         if req_id in self.server.pending_api_requests:
-            self.server.pending_api_requests[req_id]['Response'] = self.in_str[string_id].payload.decode()
-            self.server.pending_api_requests[req_id]['Event'].set()
+            request_future = self.server.pending_api_requests[req_id]
+            # The future could have been cancelled by a timeout before execute() removed it
+            if not request_future.done():
+                request_future.set_result(self.in_str[string_id].payload.decode())
             # Remove the string after using it
             self.in_str.pop(string_id, None)
             return b'ok', b'Forwarded response'
@@ -434,6 +550,8 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
             asyncio.create_task(self.forward_dapi_response(data))
             return b'ok', b'Response forwarded to worker'
         else:
+            # The response arrived after its request timed out. Nobody will read the string.
+            self.in_str.pop(string_id, None)
             raise exception.WazuhClusterError(3032, extra_message=req_id)
 
     def get_nodes(self, arguments: Dict) -> Tuple[bytes, Dict]:
@@ -727,10 +845,8 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
             raise received_filename
         logger.debug(f"Received file from worker: '{received_filename}'")
 
-        # Dict with metadata of files and path to zipdir (directory with decompressed files).
-        files_metadata, decompressed_files_path = await cluster.async_decompress_files(received_filename)
-        # There are no files inside decompressed_files_path, only files_metadata.json which has already been loaded.
-        shutil.rmtree(decompressed_files_path)
+        # Dict with metadata of files. Only files_metadata.json is sent, so nothing needs to be written to disk.
+        files_metadata, _ = await cluster.async_decompress_files(received_filename, manifest_only=True)
 
         # Classify files in shared, missing, extra and extra valid.
         files_classif = cluster.compare_files(self.server.integrity_control, files_metadata, self.name)
@@ -741,7 +857,7 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
                                             'date_end_master': utils.get_utc_now().strftime(DECIMALS_DATE_FORMAT)})
 
         # Get the total number of files that require some change.
-        if not functools.reduce(operator.add, map(len, files_classif.values())):
+        if not any(files_classif.values()):
             logger.info(f"Finished in {total_time:.3f}s. Received metadata of {len(files_metadata)} files. "
                         f"Sync not required.")
             await self.send_request(command=b'syn_m_c_ok', data=b'')
@@ -772,7 +888,7 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
                     f"Files to delete in worker: {len(files_classif['extra'])}")
 
         # Send files and metadata to the worker node.
-        metadata_len = functools.reduce(operator.add, map(len, files_classif.values()))
+        metadata_len = sum(map(len, files_classif.values()))
         master_files_paths = files_classif['shared'].keys() | files_classif['missing'].keys()
         await self.integrity.sync(master_files_paths, files_classif, metadata_len, self.server.task_pool,
                                   self.current_zip_limit)
@@ -825,12 +941,12 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
         # Create a child process to run the task.
         try:
             result = await cluster.run_in_pool(self.loop, self.server.task_pool, self.process_files_from_worker,
-                                               files_metadata, decompressed_files_path, self.cluster_items, self.name,
+                                               files_metadata, decompressed_files_path, self.cluster_items,
                                                self.cluster_items['intervals']['master']['timeout_extra_valid'])
         except Exception as e:
             raise exception.WazuhClusterError(3038, extra_message=str(e))
         finally:
-            shutil.rmtree(decompressed_files_path)
+            await asyncio.to_thread(shutil.rmtree, decompressed_files_path)
 
         # Log any possible error found in the process.
         self.integrity_sync_status['total_extra_valid'] = result['total_updated']
@@ -841,7 +957,7 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
 
     @staticmethod
     def process_files_from_worker(files_metadata: Dict, decompressed_files_path: str, cluster_items: dict,
-                                  worker_name: str, timeout: int):
+                                  timeout: int):
         """Iterate over received files from worker and updates the local ones.
 
         Parameters
@@ -852,8 +968,6 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
             Filepath of the decompressed received zipfile.
         cluster_items : dict
             Object containing cluster internal variables from the cluster.json file.
-        worker_name : str
-            Name of the worker instance. Used to access the correct worker folder.
         timeout : int
             Seconds to wait before stopping the task.
 
@@ -865,6 +979,9 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
         result = {'total_updated': 0, 'errors_per_folder': defaultdict(list), 'generic_errors': []}
 
         try:
+            # Owner of every updated file. Resolved once, as it requires looking up the user and group databases.
+            ownership = (common.wazuh_uid(), common.wazuh_gid())
+
             with utils.Timeout(timeout):
                 for file_path, data in files_metadata.items():
                     full_path = os.path.join(common.WAZUH_PATH, file_path)
@@ -882,32 +999,24 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
                             try:
                                 # Destination path.
                                 full_unmerged_name = os.path.join(common.WAZUH_PATH, unmerged_file_path)
-                                # Path where to create the file before moving it to the destination path.
-                                tmp_unmerged_path = os.path.join(common.WAZUH_PATH, 'queue', 'cluster', worker_name,
-                                                                 os.path.basename(unmerged_file_path))
 
                                 # Format the file_data specified inside the merged file.
-                                try:
-                                    mtime = utils.get_utc_strptime(file_time, '%Y-%m-%d %H:%M:%S.%f%z')
-                                except ValueError:
-                                    mtime = utils.get_utc_strptime(file_time, '%Y-%m-%d %H:%M:%S%z')
+                                mtime = parse_merged_file_time(file_time)
 
                                 # If the file already existed, check if it is older than the one from worker.
-                                if os.path.isfile(full_unmerged_name):
+                                try:
                                     local_mtime = utils.get_date_from_timestamp(
                                         int(os.stat(full_unmerged_name).st_mtime))
                                     if local_mtime > mtime:
                                         continue
+                                except FileNotFoundError:
+                                    pass
 
-                                # Create file in temporal path and safe move it to the destination path.
-                                with open(tmp_unmerged_path, 'wb') as f:
-                                    f.write(file_data)
-
+                                # Write the file next to the destination path and atomically replace it.
                                 mtime_epoch = timegm(mtime.timetuple())
-                                utils.safe_move(tmp_unmerged_path, full_unmerged_name,
-                                                ownership=(common.wazuh_uid(), common.wazuh_gid()),
-                                                permissions=cluster_items['files'][item_key]['permissions'],
-                                                time=(mtime_epoch, mtime_epoch))
+                                utils.safe_write(full_unmerged_name, file_data, ownership=ownership,
+                                                 permissions=cluster_items['files'][item_key]['permissions'],
+                                                 time=(mtime_epoch, mtime_epoch))
                                 result['total_updated'] += 1
                             except TimeoutError as e:
                                 raise e
@@ -918,7 +1027,7 @@ class MasterHandler(server.AbstractServerHandler, c_common.WazuhCommon):
                     else:
                         try:
                             zip_path = os.path.join(decompressed_files_path, file_path)
-                            utils.safe_move(zip_path, full_path, ownership=(common.wazuh_uid(), common.wazuh_gid()),
+                            utils.safe_move(zip_path, full_path, ownership=ownership,
                                             permissions=cluster_items['files'][item_key]['permissions'])
                         except TimeoutError as e:
                             raise e
@@ -1004,7 +1113,7 @@ class Master(server.AbstractServer):
         self.dapi = dapi.APIRequestQueue(server=self)
         self.sendsync = dapi.SendSyncRequestQueue(server=self)
         self.tasks.extend([self.dapi.run, self.sendsync.run, self.file_status_update, self.agent_groups_update])
-        # pending API requests waiting for a response
+        # Pending API requests waiting for a response. Each request ID is mapped to the future that will hold it.
         self.pending_api_requests = {}
 
     def to_dict(self) -> Dict:
@@ -1126,20 +1235,17 @@ class Master(server.AbstractServer):
         if filter_node is None or self.configuration['node_name'] in filter_node:
             workers_info.update({self.configuration['node_name']: self.to_dict()})
 
-        # Get active agents by node and format last keep alive date format
-        active_agents = Agent.get_agents_overview(filters={'status': 'active', 'node_name': filter_node},
-                                                  q="id!=000")['items']
-        for agent in active_agents:
-            if (agent_node := agent["node_name"]) in workers_info.keys():
-                workers_info[agent_node]["info"]["n_active_agents"] = \
-                    workers_info[agent_node]["info"].get("n_active_agents", 0) + 1
+        # Count active agents by node with a single grouped query and format last keep alive date format
+        with WazuhDBQueryGroupByAgents(filter_fields=['node_name'], select=['node_name'], offset=0, limit=None,
+                                       sort=None, search=None, query="id!=000", min_select_fields=set(), count=True,
+                                       get_data=True, filters={'status': 'active', 'node_name': filter_node}
+                                       ) as db_query:
+            active_agents = {item['node_name']: item['count'] for item in db_query.run()['items']}
         for node_name in workers_info.keys():
-            if workers_info[node_name]["info"].get("n_active_agents") is None:
-                workers_info[node_name]["info"]["n_active_agents"] = 0
+            workers_info[node_name]["info"]["n_active_agents"] = active_agents.get(node_name, 0)
             if workers_info[node_name]['info']['type'] != 'master':
-                workers_info[node_name]['status']['last_keep_alive'] = str(
-                    utils.get_date_from_timestamp(workers_info[node_name]['status']['last_keep_alive']
-                                                  ).strftime(DECIMALS_DATE_FORMAT))
+                workers_info[node_name]['status']['last_keep_alive'] = \
+                    format_keep_alive(workers_info[node_name]['status']['last_keep_alive'])
 
         return {"n_connected_nodes": n_connected_nodes, "nodes": workers_info}
 
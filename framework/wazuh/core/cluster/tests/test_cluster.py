@@ -384,7 +384,19 @@ async def test_async_decompress_files(decompress_files_mock):
     zip_path = '/foo/bar/'
     output = await cluster.async_decompress_files(zip_path=zip_path)
     assert output == decompress_files_mock.return_value
-    decompress_files_mock.assert_called_once_with(zip_path, 'files_metadata.json')
+    decompress_files_mock.assert_called_once_with(zip_path, 'files_metadata.json', False)
+
+
+def test_iter_decompress_files():
+    """Check if the files are lazily decompressed one by one."""
+    compress_data = f'path{cluster.PATH_SEP}'.encode() + zlib.compress(b'content') + cluster.FILE_SEP.encode() + \
+                    f'path2{cluster.PATH_SEP}'.encode() + zlib.compress(b'content2')
+
+    with patch('builtins.open', mock_open(read_data=compress_data)) as open_mock:
+        files = cluster.iter_decompress_files('/foo/bar/')
+        open_mock.assert_not_called()
+        assert list(files) == [('path', b'content'), ('path2', b'content2')]
+        open_mock.assert_called_once_with('/foo/bar/', 'rb')
 
 
 @pytest.mark.asyncio
@@ -416,6 +428,21 @@ async def test_decompress_files_ok(json_loads_mock, mkdir_with_mode_mock, remove
                                             call('/foo/bar/dir/path2', 'wb'), call('/foo/bar/dir/files_metadata.json')]
 
 
+@patch('wazuh.core.cluster.cluster.remove')
+@patch('wazuh.core.cluster.cluster.mkdir_with_mode')
+def test_decompress_files_manifest_only(mkdir_with_mode_mock, remove_mock):
+    """Check if only the metadata json is loaded, without writing any file, when requested."""
+    zip_path = '/foo/bar/'
+    compress_data = f'path{cluster.PATH_SEP}'.encode() + zlib.compress(b'content') + cluster.FILE_SEP.encode() + \
+                    f'files_metadata.json{cluster.PATH_SEP}'.encode() + zlib.compress(b'{"path": {}}')
+
+    with patch('builtins.open', mock_open(read_data=compress_data)) as open_mock:
+        assert cluster.decompress_files(zip_path, manifest_only=True) == ({'path': {}}, None)
+        open_mock.assert_called_once_with(zip_path, 'rb')
+        mkdir_with_mode_mock.assert_not_called()
+        remove_mock.assert_called_once_with(zip_path)
+
+
 @pytest.mark.asyncio
 @patch('shutil.rmtree')
 @patch('zlib.decompress', return_value=Exception)
@@ -12,7 +12,7 @@ import logging
 import os
 import sys
 from contextvars import ContextVar
-from datetime import datetime
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock, mock_open, call, ANY
 
 import cryptography
@@ -1669,6 +1669,14 @@ def test_as_wazuh_object_ko():
         cluster_common.as_wazuh_object({"__callable__": {"__name__": "value", "__wazuh__": "value"}})
 
 
+def test_health_json_default():
+    """Check if the dates of the health information are correctly serialized."""
+    assert cluster_common.health_json_default(datetime(1970, 1, 1, tzinfo=timezone.utc)) == "n/a"
+    assert cluster_common.health_json_default(datetime(2021, 10, 14, 10, 20, 30, tzinfo=timezone.utc)) == \
+           "2021-10-14 10:20:30+00:00"
+    assert cluster_common.health_json_default(object()) is None
+
+
 def get_handler():
     """Return a Handler object. This is an auxiliary method."""
     return cluster_common.Handler(fernet_key=fernet_key, cluster_items=cluster_items, logger=logging.getLogger("wazuh"))
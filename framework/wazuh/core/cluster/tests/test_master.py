@@ -71,6 +71,32 @@ def get_master():
                              cluster_items=cluster_items, enable_ssl=False)
 
 
+@pytest.mark.parametrize('file_time, expected_date', [
+    ('2021-11-02 10:51:23.123456+00:00', datetime(2021, 11, 2, 10, 51, 23, 123456, tzinfo=timezone.utc)),
+    ('2021-11-02 10:51:23.123+00:00', datetime(2021, 11, 2, 10, 51, 23, 123000, tzinfo=timezone.utc)),
+    ('2021-11-02 10:51:23+00:00', datetime(2021, 11, 2, 10, 51, 23, tzinfo=timezone.utc)),
+    ('2021-11-02 10:51:23.1234+0000', datetime(2021, 11, 2, 10, 51, 23, 123400, tzinfo=timezone.utc)),
+    ('2021-11-02 10:51:23+0000', datetime(2021, 11, 2, 10, 51, 23, tzinfo=timezone.utc))
+])
+def test_parse_merged_file_time(file_time, expected_date):
+    """Check if the modification time written in merged files is properly parsed."""
+    assert master.parse_merged_file_time(file_time) == expected_date
+
+
+def test_parse_merged_file_time_ko():
+    """Check if an exception is raised when the modification time has an unknown format."""
+    with pytest.raises(ValueError):
+        master.parse_merged_file_time('02/11/2021')
+
+
+def test_format_keep_alive():
+    """Check if the keep alive timestamps are properly formatted and only converted once."""
+    master.format_keep_alive.cache_clear()
+    assert master.format_keep_alive(1635811200.5) == '2021-11-02T00:00:00.500000Z'
+    assert master.format_keep_alive(1635811200.5) == '2021-11-02T00:00:00.500000Z'
+    assert master.format_keep_alive.cache_info().hits == 1
+
+
 # Test ReceiveIntegrityTask class
 
 @patch("asyncio.create_task")
@@ -304,6 +330,7 @@ def test_master_handler_init():
         assert master_handler.version == ""
         assert master_handler.cluster_name == ""
         assert master_handler.node_type == ""
+        assert master_handler.encoded_name == b""
         assert master_handler.task_loggers == {}
         assert master_handler.tag == "Worker"
         assert master_handler.current_zip_limit == cluster_items['intervals']['communication']['max_zip_size']
@@ -441,6 +468,7 @@ def test_master_handler_process_request(logger_mock):
 
     with patch.object(DapiMock, "add_request") as add_request_mock:
         master_handler.name = "Master"
+        master_handler.encoded_name = b"Master"
         assert master_handler.process_request(command=b'dapi',
                                               data=b"data") == (b"ok", b"Added request to API requests queue")
         add_request_mock.assert_called_once_with(master_handler.name.encode() + b"*" + b"data")
@@ -495,7 +523,7 @@ def test_master_handler_process_request(logger_mock):
 
 
 @pytest.mark.asyncio
-@patch("asyncio.wait_for")
+@patch("asyncio.wait_for", return_value="")
 @patch("wazuh.core.cluster.master.uuid4", return_value=10101010)
 async def test_master_handler_execute_ok(uuid4_mock, wait_for_mock):
     """Check if a DAPI response is properly sent."""
@@ -506,7 +534,7 @@ async def test_master_handler_execute_ok(uuid4_mock, wait_for_mock):
         """Auxiliary class."""
 
         def __init__(self):
-            self.pending_api_requests = {uuid4_mock.return_value: None}
+            self.pending_api_requests = {}
             self.clients = {"client": LocalServer()}
 
     class LocalServer:
@@ -542,6 +570,33 @@ async def test_master_handler_execute_ok(uuid4_mock, wait_for_mock):
     uuid4_mock.assert_called_with()
     assert uuid4_mock.call_count == 3
     assert wait_for_mock.call_count == 2
+    assert master_handler.server.pending_api_requests == {}
+
+
+@pytest.mark.asyncio
+@patch("wazuh.core.cluster.master.uuid4", return_value="10101010")
+async def test_master_handler_execute_response(uuid4_mock):
+    """Check if the DAPI response set in the pending request future is returned."""
+
+    master_handler = get_master_handler()
+    master_handler.in_str[b"string_id"] = MagicMock(payload=b"response")
+
+    class Server:
+        """Auxiliary class."""
+
+        def __init__(self):
+            self.pending_api_requests = {}
+
+    async def send_request(command, data):
+        """Auxiliary function that answers the request as soon as it is sent."""
+        master_handler.process_dapi_res(data.split(b" ", 1)[0] + b" string_id")
+        return b"ok"
+
+    master_handler.server = Server()
+    with patch("wazuh.core.cluster.master.MasterHandler.send_request", side_effect=send_request):
+        assert await master_handler.execute(command=b"dapi", data=b"request", wait_for_complete=False) == "response"
+    assert master_handler.server.pending_api_requests == {}
+    assert master_handler.in_str == {}
 
 
 @pytest.mark.asyncio
@@ -614,6 +669,7 @@ def test_master_handler_hello_ok(super_hello_mock, mkdir_with_mode_mock, join_mo
     assert master_handler.version == "version"
     assert master_handler.cluster_name == "cluster_name"
     assert master_handler.node_type == "node_type"
+    assert master_handler.encoded_name == b"name"
 
 
 @patch("wazuh.core.cluster.master.metadata.__version__", "random")
@@ -658,7 +714,7 @@ def test_master_handler_process_dapi_res_ok():
         """Auxiliary class."""
 
         def __init__(self):
-            self.pending_api_requests = {"req_id": {"Response": None, "Event": event_mock}}
+            self.pending_api_requests = {"req_id": future_mock}
             self.payload = b"payload"
             self.local_server = LocalServer()
 
@@ -668,27 +724,25 @@ def test_master_handler_process_dapi_res_ok():
         def __init__(self):
             self.clients = {"req_id": None}
 
-    class EventMock:
-        """Auxiliary class."""
-
-        def __init__(self):
-            self.set_flag = False
-
-        def set(self):
-            """Auxiliary method."""
-            self.set_flag = True
-
     # Test the first condition
     master_handler = get_master_handler()
-    event_mock = EventMock()
+    future_mock = MagicMock(**{"done.return_value": False})
 
     master_handler.server = Server()
     master_handler.in_str[b"string_id"] = Server()
 
     assert master_handler.process_dapi_res(b"req_id string_id") == (b'ok', b'Forwarded response')
     assert master_handler.in_str == {}
-    assert event_mock.set_flag is True
-    assert master_handler.server.pending_api_requests["req_id"]["Response"] == "payload"
+    future_mock.set_result.assert_called_once_with("payload")
+
+    # Test the first condition when the request future was already cancelled by a timeout
+    future_mock.reset_mock()
+    future_mock.done.return_value = True
+    master_handler.in_str[b"string_id"] = Server()
+
+    assert master_handler.process_dapi_res(b"req_id string_id") == (b'ok', b'Forwarded response')
+    assert master_handler.in_str == {}
+    future_mock.set_result.assert_not_called()
 
     # Test the second condition
     master_handler.server.pending_api_requests = {}
@@ -716,9 +770,11 @@ def test_master_handler_process_dapi_res_ko():
             self.clients = {}
 
     master_handler.server = Server()
+    master_handler.in_str[b"string_id"] = "late response"
 
     with pytest.raises(exception.WazuhClusterError, match=r".* 3032 .*"):
         master_handler.process_dapi_res(b"req_id string_id")
+    assert master_handler.in_str == {}
 
 
 def test_master_handler_get_nodes():
@@ -1038,7 +1094,6 @@ async def test_master_handler_sync_worker_files_ok(run_in_pool_mock, decompress_
                                              master_handler.process_files_from_worker,
                                              decompress_files_mock.return_value[0],
                                              decompress_files_mock.return_value[1], master_handler.cluster_items,
-                                             master_handler.name,
                                              master_handler.cluster_items['intervals']['master']['timeout_extra_valid'])
 
 
@@ -1068,7 +1123,7 @@ async def test_master_handler_sync_worker_files_ko(wait_for_mock, decompress_fil
         master_handler.sync_tasks["task_id"].filename = ''
         await master_handler.sync_worker_files("task_id", asyncio.Event(), logging.getLogger("wazuh"))
 
-    decompress_files_mock.assert_called_once_with('', 'files_metadata.json')
+    decompress_files_mock.assert_called_once_with('', 'files_metadata.json', False)
     run_in_pool_mock.assert_not_called()
     rmtree_mock.assert_called_once_with(decompress_files_mock.return_value[1])
 
@@ -1118,7 +1173,7 @@ def test_set_date_end_master(info_mock):
 @patch("wazuh.core.cluster.master.MasterHandler.integrity_sync")
 @patch("wazuh.core.cluster.master.MasterHandler.wait_for_file")
 @patch("wazuh.core.cluster.master.MasterHandler.send_request", return_value=b"ok")
-@patch("wazuh.core.cluster.cluster.decompress_files", return_value=("files_metadata", "/decompressed/files/path"))
+@patch("wazuh.core.cluster.cluster.decompress_files", return_value=("files_metadata", None))
 async def test_master_handler_integrity_check(decompress_files_mock, send_request_mock, wait_for_file_mock,
                                               integrity_sync_mock, debug_mock, info_mock, rmtree_mock, compare_result):
     """Test if the comparison between the local and received files is properly done."""
@@ -1155,10 +1210,10 @@ async def test_master_handler_integrity_check(decompress_files_mock, send_reques
                ) as compare_mock:
         assert await master_handler.integrity_check("task_id", EventMock()) is None
         debug_mock.assert_called_once_with("Received file from worker: 'filename'")
-        decompress_files_mock.assert_called_once_with('filename', 'files_metadata.json')
+        decompress_files_mock.assert_called_once_with('filename', 'files_metadata.json', True)
         compare_mock.assert_called_once_with(True, 'files_metadata', None)
         wait_for_file_mock.assert_called_once_with(file=ANY, task_id='task_id')
-        rmtree_mock.assert_called_once_with('/decompressed/files/path')
+        rmtree_mock.assert_not_called()
         assert master_handler.integrity_check_status == {'date_start_master': '2021-11-02T00:00:00.000000Z',
                                                          'date_end_master': '2021-11-02T00:00:00.000000Z'}
         if compare_result:
@@ -1256,16 +1311,15 @@ def test_master_handler_process_files_from_worker_ok(gid_mock, uid_mock, basenam
         for mock in data:
             mock.reset_mock()
 
-    all_mocks = [basename_mock, path_join_mock]
+    all_mocks = [basename_mock, path_join_mock, gid_mock, uid_mock]
     decompressed_files_path = '/decompressed/files/path'
-    worker_name = 'wazuh'
     timeout = 0
 
     # Test the first and second try
     # Nested function: try -> 1º if and 2º exception
     result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                       decompressed_files_path=decompressed_files_path,
-                                                      cluster_items=cluster_items, worker_name=worker_name,
+                                                      cluster_items=cluster_items,
                                                       timeout=timeout)
 
     basename_mock.assert_called_with('data')
@@ -1279,92 +1333,101 @@ def test_master_handler_process_files_from_worker_ok(gid_mock, uid_mock, basenam
     basename_mock.return_value = "/os/path/basename"
     with patch("wazuh.core.cluster.cluster.unmerge_info",
                return_value=[("/file/path", "file data", '1970-01-01 00:00:00.000+00:00')]) as unmerge_info_mock:
-        with patch('os.path.isfile', return_value=True) as isfile_mock:
-            with patch('os.stat', return_value=StatMock()) as os_stas_mock:
-                # Test until the 'continue'
-                result = master_handler.process_files_from_worker(files_metadata=files_metadata,
-                                                                  decompressed_files_path=decompressed_files_path,
-                                                                  cluster_items=cluster_items, worker_name=worker_name,
-                                                                  timeout=timeout)
+        with patch('os.stat', return_value=StatMock()) as os_stat_mock:
+            # Test until the 'continue'
+            result = master_handler.process_files_from_worker(files_metadata=files_metadata,
+                                                              decompressed_files_path=decompressed_files_path,
+                                                              cluster_items=cluster_items,
+                                                              timeout=timeout)
 
-                basename_mock.assert_has_calls([call('data'), call('/file/path')])
-                path_join_mock.assert_has_calls([call(common.WAZUH_PATH, 'data'),
-                                                 call(common.WAZUH_PATH, '/file/path'),
-                                                 call(common.WAZUH_PATH, 'queue', 'cluster', 'wazuh',
-                                                      '/os/path/basename')])
-                unmerge_info_mock.assert_called_once_with('type', decompressed_files_path, 'name')
-                assert result == {'total_updated': 0, 'errors_per_folder': defaultdict(list), 'generic_errors': []}
-                isfile_mock.assert_called_once_with(path_join_mock.return_value)
-                os_stas_mock.assert_called_once_with(path_join_mock.return_value)
-
-                # Reset all the used mocks
-                all_mocks += [unmerge_info_mock, isfile_mock, os_stas_mock]
-                reset_mock(all_mocks)
-
-                # Test until the 'continue'
-                unmerge_info_mock.return_value = [("/file/path", "file data", '1970-01-01 00:00:00+00:00')]
-                result = master_handler.process_files_from_worker(files_metadata=files_metadata,
-                                                                  decompressed_files_path=decompressed_files_path,
-                                                                  cluster_items=cluster_items, worker_name=worker_name,
-                                                                  timeout=timeout)
+            basename_mock.assert_called_once_with('data')
+            path_join_mock.assert_has_calls([call(common.WAZUH_PATH, 'data'),
+                                             call(common.WAZUH_PATH, '/file/path')])
+            unmerge_info_mock.assert_called_once_with('type', decompressed_files_path, 'name')
+            assert result == {'total_updated': 0, 'errors_per_folder': defaultdict(list), 'generic_errors': []}
+            os_stat_mock.assert_called_once_with(path_join_mock.return_value)
 
-                basename_mock.assert_has_calls([call('data'), call('/file/path')])
-                path_join_mock.assert_has_calls([call(common.WAZUH_PATH, 'data'),
-                                                 call(common.WAZUH_PATH, '/file/path'),
-                                                 call(common.WAZUH_PATH, 'queue', 'cluster', 'wazuh',
-                                                      '/os/path/basename')])
-                unmerge_info_mock.assert_called_once_with('type', decompressed_files_path, 'name')
-                assert result == {'total_updated': 0, 'errors_per_folder': defaultdict(list), 'generic_errors': []}
-                isfile_mock.assert_called_once_with(path_join_mock.return_value)
-                os_stas_mock.assert_called_once_with(path_join_mock.return_value)
+            # Reset all the used mocks
+            all_mocks += [unmerge_info_mock, os_stat_mock]
+            reset_mock(all_mocks)
 
-                # Reset all the used mocks
-                all_mocks += [unmerge_info_mock, isfile_mock, os_stas_mock]
-                reset_mock(all_mocks)
+            # Test until the 'continue'
+            unmerge_info_mock.return_value = [("/file/path", "file data", '1970-01-01 00:00:00+00:00')]
+            result = master_handler.process_files_from_worker(files_metadata=files_metadata,
+                                                              decompressed_files_path=decompressed_files_path,
+                                                              cluster_items=cluster_items,
+                                                              timeout=timeout)
+
+            basename_mock.assert_called_once_with('data')
+            path_join_mock.assert_has_calls([call(common.WAZUH_PATH, 'data'),
+                                             call(common.WAZUH_PATH, '/file/path')])
+            unmerge_info_mock.assert_called_once_with('type', decompressed_files_path, 'name')
+            assert result == {'total_updated': 0, 'errors_per_folder': defaultdict(list), 'generic_errors': []}
+            os_stat_mock.assert_called_once_with(path_join_mock.return_value)
 
-            # Test after the 'continue'
-            isfile_mock.return_value = False
+            # Reset all the used mocks
+            reset_mock(all_mocks)
+
+            # Test after the 'continue', when the file does not exist yet
+            os_stat_mock.side_effect = FileNotFoundError
+            result = master_handler.process_files_from_worker(files_metadata=files_metadata,
+                                                              decompressed_files_path=decompressed_files_path,
+                                                              cluster_items=cluster_items,
+                                                              timeout=timeout)
 
-            with patch('builtins.open'):
+            assert result == {'errors_per_folder': defaultdict(list, {'queue/testing/': ["'queue/testing/'"]}),
+                              'generic_errors': [], 'total_updated': 0}
+            basename_mock.assert_called_once_with('data')
+            path_join_mock.assert_has_calls([call(common.WAZUH_PATH, 'data'),
+                                             call(common.WAZUH_PATH, '/file/path')])
+            unmerge_info_mock.assert_called_once_with('type', decompressed_files_path, 'name')
+            os_stat_mock.assert_called_once_with(path_join_mock.return_value)
+            gid_mock.assert_called_once_with()
+            uid_mock.assert_called_once_with()
+
+            # Reset all the used mocks
+            all_mocks += [safe_move_mock]
+            reset_mock(all_mocks)
+
+            # Test after the 'continue', when the file is written to its destination
+            files_metadata['data']['cluster_item_key'] = 'cluster_item_key'
+            with patch('wazuh.core.cluster.master.utils.safe_write') as safe_write_mock, \
+                    patch('builtins.open') as open_mock:
                 result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                                   decompressed_files_path=decompressed_files_path,
                                                                   cluster_items=cluster_items,
-                                                                  worker_name=worker_name,
                                                                   timeout=timeout)
 
-                assert result == {'errors_per_folder': defaultdict(list, {'queue/testing/': ["'queue/testing/'"]}),
-                                  'generic_errors': [], 'total_updated': 0}
-                basename_mock.assert_has_calls([call('data'), call('/file/path')])
-                path_join_mock.assert_has_calls([call(common.WAZUH_PATH, 'data'),
-                                                 call(common.WAZUH_PATH, '/file/path'),
-                                                 call(common.WAZUH_PATH, 'queue', 'cluster', 'wazuh',
-                                                      '/os/path/basename')])
-                unmerge_info_mock.assert_called_once_with('type', decompressed_files_path, 'name')
-                isfile_mock.assert_called_once_with(path_join_mock.return_value)
-                gid_mock.assert_called_once_with()
-                uid_mock.assert_called_once_with()
-
-                # Reset all the used mocks
-                all_mocks += [gid_mock, uid_mock, safe_move_mock]
-                reset_mock(all_mocks)
+                assert result == {'total_updated': 1, 'errors_per_folder': defaultdict(list), 'generic_errors': []}
+                safe_write_mock.assert_called_once_with(path_join_mock.return_value, "file data",
+                                                        ownership=(uid_mock.return_value, gid_mock.return_value),
+                                                        permissions=cluster_items['files']['cluster_item_key'][
+                                                            'permissions'],
+                                                        time=(0, 0))
+                # Nothing is written to a temporary file inside queue/cluster/<worker> anymore
+                open_mock.assert_not_called()
+                safe_move_mock.assert_not_called()
+                assert not any('queue/cluster' in str(path_join_call)
+                               for path_join_call in path_join_mock.call_args_list)
+
+            files_metadata['data']['cluster_item_key'] = 'queue/testing/'
+            reset_mock(all_mocks)
 
             # Test the Timeout
-            isfile_mock.side_effect = TimeoutError
+            os_stat_mock.side_effect = TimeoutError
             result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                               decompressed_files_path=decompressed_files_path,
                                                               cluster_items=cluster_items,
-                                                              worker_name=worker_name,
                                                               timeout=timeout)
 
             assert result == {'total_updated': 0, 'errors_per_folder': defaultdict(list),
                               'generic_errors': ['Timeout processing extra-valid files.']}
 
             # Test the Except present in the second if
-            isfile_mock.side_effect = Exception
+            os_stat_mock.side_effect = Exception
             result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                               decompressed_files_path=decompressed_files_path,
                                                               cluster_items=cluster_items,
-                                                              worker_name=worker_name,
                                                               timeout=timeout)
 
             assert result == {'total_updated': 0, 'errors_per_folder': defaultdict(list, {'queue/testing/': ['']}),
@@ -1377,7 +1440,6 @@ def test_master_handler_process_files_from_worker_ok(gid_mock, uid_mock, basenam
     result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                       decompressed_files_path=decompressed_files_path,
                                                       cluster_items=cluster_items,
-                                                      worker_name=worker_name,
                                                       timeout=timeout)
 
     assert result == {'errors_per_folder': defaultdict(list, {'queue/testing/': ["'queue/testing/'"]}),
@@ -1389,7 +1451,6 @@ def test_master_handler_process_files_from_worker_ok(gid_mock, uid_mock, basenam
     result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                       decompressed_files_path=decompressed_files_path,
                                                       cluster_items=cluster_items,
-                                                      worker_name=worker_name,
                                                       timeout=timeout)
 
     assert result == {'errors_per_folder': defaultdict(list, {'queue/testing/': ["'queue/testing/'"]}),
@@ -1399,7 +1460,6 @@ def test_master_handler_process_files_from_worker_ok(gid_mock, uid_mock, basenam
     result = master_handler.process_files_from_worker(files_metadata=files_metadata,
                                                       decompressed_files_path=decompressed_files_path,
                                                       cluster_items=cluster_items,
-                                                      worker_name=worker_name,
                                                       timeout=timeout)
 
     assert result == {'errors_per_folder': defaultdict(list, {'queue/testing/': ["'queue/testing/'"]}),
@@ -1731,8 +1791,8 @@ async def test_master_file_status_update_ok(run_in_pool_mock, asyncio_sleep_mock
 
 
 @patch('asyncio.get_running_loop', return_value=loop)
-@patch("wazuh.core.agent.Agent.get_agents_overview", return_value={'items': [{'node_name': '1'}]})
-def test_master_get_health(get_running_loop_mock, get_agent_overview_mock):
+@patch("wazuh.core.cluster.master.WazuhDBQueryGroupByAgents")
+def test_master_get_health(db_query_mock, get_running_loop_mock):
     """Check if nodes and the synchronization information is properly obtained."""
 
     class MockDict(Dict):
@@ -1740,7 +1800,7 @@ def test_master_get_health(get_running_loop_mock, get_agent_overview_mock):
             super().__init__(**kwargs)
 
         def to_dict(self):
-            return {'info': {'n_active_agents': 4, 'type': 'worker'}, 'status': {'last_keep_alive': 0}}
+            return {'info': {'type': 'worker'}, 'status': {'last_keep_alive': 0}}
 
     class MockMaster(master.Master):
         def to_dict(self):
@@ -1751,6 +1811,7 @@ def test_master_get_health(get_running_loop_mock, get_agent_overview_mock):
                                              'node_type': 'master'},
                               cluster_items=cluster_items, enable_ssl=False)
     master_class.clients = {'1': MockDict({'testing': 'dict'})}
+    db_query_mock.return_value.__enter__.return_value.run.return_value = {'items': [{'node_name': '1', 'count': 5}]}
 
     assert master_class.get_health({'jey': 'value', 'hoy': 'value'}) == {'n_connected_nodes': 0, 'nodes': {}}
     assert master_class.get_health(None) == {'n_connected_nodes': 1,
@@ -1759,6 +1820,9 @@ def test_master_get_health(get_running_loop_mock, get_agent_overview_mock):
                                                                  {'last_keep_alive': '1970-01-01T00:00:00.000000Z'}},
                                                        'master': {'testing': 'get_health',
                                                                   'info': {'type': 'master', 'n_active_agents': 0}}}}
+    db_query_mock.assert_called_with(filter_fields=['node_name'], select=['node_name'], offset=0, limit=None,
+                                     sort=None, search=None, query="id!=000", min_select_fields=set(), count=True,
+                                     get_data=True, filters={'status': 'active', 'node_name': None})
 
 
 @patch('asyncio.get_running_loop', return_value=loop)
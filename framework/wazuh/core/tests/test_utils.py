@@ -519,6 +519,41 @@ def test_safe_move_exception(mock_utime, mock_chmod, mock_chown):
         assert (os.path.exists(target_file))
 
 
+@pytest.mark.parametrize('ownership, time, permissions',
+                         [(None, None, None),
+                          ((1000, 1000), (12345, 12345), 0o660)]
+                         )
+@patch('wazuh.core.utils.os.fchown')
+def test_safe_write(mock_fchown, ownership, time, permissions):
+    """Test safe_write function."""
+    with TemporaryDirectory() as tmpdirname:
+        target_file = os.path.join(tmpdirname, 'target')
+        utils.safe_write(target_file, b'content', ownership=ownership, time=time, permissions=permissions)
+
+        with open(target_file, 'rb') as f:
+            assert f.read() == b'content'
+        assert not os.path.exists(os.path.join(tmpdirname, '.target.tmp'))
+        if ownership is not None:
+            mock_fchown.assert_called_once_with(ANY, *ownership)
+        else:
+            mock_fchown.assert_not_called()
+        if time is not None:
+            assert os.stat(target_file).st_mtime == time[1]
+        if permissions is not None:
+            assert os.stat(target_file).st_mode & 0o777 == permissions
+
+
+def test_safe_write_exception():
+    """Test safe_write function when the target cannot be atomically replaced."""
+    with TemporaryDirectory() as tmpdirname:
+        target_file = os.path.join(tmpdirname, 'target')
+        with patch('wazuh.core.utils.rename', side_effect=OSError(1)):
+            utils.safe_write(target_file, b'content')
+
+        with open(target_file, 'rb') as f:
+            assert f.read() == b'content'
+
+
 @pytest.mark.parametrize('dir_name, path_exists', [
     ('/var/test_path', True),
     ('./var/test_path/', False)
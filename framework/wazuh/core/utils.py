@@ -688,6 +688,48 @@ def safe_move(source: str, target: str, ownership: tuple = None, time: tuple = N
         move(tmp_target, target, copy_function=full_copy)
 
 
+def safe_write(target: str, data: bytes, ownership: tuple = None, time: tuple = None, permissions: int = None):
+    """Write data to a file atomically.
+
+    The data is written to a temporary file next to the target, so it can be renamed over the target once its
+    metadata is set up, without moving the file between directories.
+
+    Parameters
+    ----------
+    target : str
+        Full path to target file.
+    data : bytes
+        Content to be written.
+    ownership : tuple
+        Tuple in the form (user, group) to be set up after the file is written.
+    time : tuple
+        Tuple in the form (addition_timestamp, modified_timestamp).
+    permissions : int
+        String mask in octal notation. I.e.: 0o640.
+    """
+    tmp_path, tmp_filename = path.split(target)
+    tmp_target = path.join(tmp_path, f".{tmp_filename}.tmp")
+
+    with open(tmp_target, 'wb') as f:
+        f.write(data)
+        f.flush()
+
+        # Set up metadata through the open file descriptor
+        if ownership is not None:
+            os.fchown(f.fileno(), *ownership)
+        if permissions is not None:
+            os.fchmod(f.fileno(), permissions)
+        if time is not None:
+            utime(f.fileno(), time)
+
+    try:
+        # Overwrite the file atomically.
+        rename(tmp_target, target)
+    except OSError:
+        # Target is a mounted file (i.e. in a Docker container), so it cannot be replaced atomically.
+        move(tmp_target, target, copy_function=full_copy)
+
+
 def mkdir_with_mode(name: str, mode: int = 0o770):
     """Create a directory with specified permissions.
 
@@ -5,16 +5,89 @@
 import asyncio
 import re
 from collections import defaultdict
-from functools import wraps
+from functools import lru_cache, wraps
 
 from wazuh.core.agent import get_agents_info, get_groups, expand_group
-from wazuh.core.common import rbac, broadcast, cluster_nodes
+from wazuh.core.common import rbac, broadcast, cluster_nodes, context_cached
 from wazuh.core.exception import WazuhPermissionError
 from wazuh.core.results import AffectedItemsWazuhResult
 from wazuh.core.utils import expand_rules, expand_lists, expand_decoders
 from wazuh.rbac.orm import RolesManager, PoliciesManager, AuthenticationManager, RulesManager
 
 integer_resources = ['user:id', 'role:id', 'rule:id', 'policy:id']
+_re_resource = re.compile(r'^([a-z*]+:[a-z*]+):([^{\}]+|\*|{(\w+)})$')
+
+
+@context_cached('system_roles')
+def _expand_roles() -> set:
+    """Get the IDs of all the security roles in the system.
+
+    Returns
+    -------
+    set
+        Role IDs.
+    """
+    with RolesManager() as rm:
+        roles = rm.get_roles()
+    return {str(role_id.id) for role_id in roles}
+
+
+@context_cached('system_policies')
+def _expand_policies() -> set:
+    """Get the IDs of all the security policies in the system.
+
+    Returns
+    -------
+    set
+        Policy IDs.
+    """
+    with PoliciesManager() as pm:
+        policies = pm.get_policies()
+    return {str(policy_id.id) for policy_id in policies}
+
+
+@context_cached('system_users')
+def _expand_users() -> set:
+    """Get the IDs of all the API users in the system.
+
+    Returns
+    -------
+    set
+        User IDs.
+    """
+    with AuthenticationManager() as auth:
+        users = auth.get_users()
+    return {str(user['user_id']) for user in users}
+
+
+@context_cached('system_security_rules')
+def _expand_security_rules() -> set:
+    """Get the IDs of all the security rules in the system.
+
+    Returns
+    -------
+    set
+        Security rule IDs.
+    """
+    with RulesManager() as rum:
+        rules = rum.get_rules()
+    return {str(rule_id.id) for rule_id in rules}
+
+
+# Functions used to transform the wildcard * to the resources of the system, by resource type
+wildcard_expansions = {
+    'agent:id': get_agents_info,
+    'group:id': get_groups,
+    'role:id': _expand_roles,
+    'policy:id': _expand_policies,
+    'user:id': _expand_users,
+    'rule:id': _expand_security_rules,
+    'rule:file': expand_rules,
+    'decoder:file': expand_decoders,
+    'list:file': expand_lists,
+    'node:id': lambda: set(cluster_nodes.get()),
+    '*:*': lambda: {'*'},  # Resourceless
+}
 
 
 def _expand_resource(resource: str) -> set:
@@ -39,40 +112,8 @@ def _expand_resource(resource: str) -> set:
 
     # We need to transform the wildcard * to the resource of the system
     if value == '*':
-        if resource_type == 'agent:id':
-            return get_agents_info()
-        elif resource_type == 'group:id':
-            return get_groups()
-        elif resource_type == 'role:id':
-            with RolesManager() as rm:
-                roles = rm.get_roles()
-            return {str(role_id.id) for role_id in roles}
-        elif resource_type == 'policy:id':
-            with PoliciesManager() as pm:
-                policies = pm.get_policies()
-            return {str(policy_id.id) for policy_id in policies}
-        elif resource_type == 'user:id':
-            users_system = set()
-            with AuthenticationManager() as auth:
-                users = auth.get_users()
-            for user in users:
-                users_system.add(str(user['user_id']))
-            return users_system
-        elif resource_type == 'rule:id':
-            with RulesManager() as rum:
-                rules = rum.get_rules()
-            return {str(rule_id.id) for rule_id in rules}
-        elif resource_type == 'rule:file':
-            return expand_rules()
-        elif resource_type == 'decoder:file':
-            return expand_decoders()
-        elif resource_type == 'list:file':
-            return expand_lists()
-        elif resource_type == 'node:id':
-            return set(cluster_nodes.get())
-        elif resource_type == '*:*':  # Resourceless
-            return {'*'}
-        return set()
+        expansion = wildcard_expansions.get(resource_type)
+        return expansion() if expansion is not None else set()
     # We return the value casted to set
     else:
         return {value}
@@ -100,15 +141,15 @@ def _combination_defined_rbac(needed_resources: list, user_resources: str) -> bo
             return False
         counter = 0
         for index, element in enumerate(split_needed_resource):
-            user_resource_identifier = ':'.join(split_user_resource[index].split(':')[:-1])
-            needed_resource_identifier = ':'.join(split_needed_resource[index].split(':')[:-1])
+            user_resource_identifier, _, user_resource_value = split_user_resource[index].rpartition(':')
+            needed_resource_identifier, _, needed_resource_value = element.rpartition(':')
             if user_resource_identifier != needed_resource_identifier:  # Not the same resource
                 return False
             # * wildcard founded in RBAC permissions for the required resource
-            if split_user_resource[index].split(':')[-1] == '*':
+            if user_resource_value == '*':
                 counter += 1
             else:
-                if split_user_resource[index] == element or element.split(':')[-1] == '*':
+                if split_user_resource[index] == element or needed_resource_value == '*':
                     counter += 1
                 else:
                     break
@@ -136,7 +177,8 @@ def _optimize_resources(req_resources: list) -> defaultdict:
     """
     resources_value_odict = defaultdict(set)
     for element in req_resources:
-        resources_value_odict[':'.join(element.split(':')[:-1])].add(element.split(':')[-1])
+        identifier, _, value = element.rpartition(':')
+        resources_value_odict[identifier].add(value)
 
     return resources_value_odict
 
@@ -155,7 +197,7 @@ def _black_expansion(req_resources: list, final_user_permissions: dict):
     for req_resource in req_resources:
         split_combination = req_resource.split('&')
         for chunk in split_combination:
-            identifier = ':'.join(chunk.split(':')[:-1])
+            identifier = chunk.rpartition(':')[0]
             # Modify the identifier agent:group by agent:id in the resources required by the system
             if identifier == 'agent:group':
                 identifier = 'agent:id'
@@ -211,11 +253,15 @@ def _single_processor(req_resources: list, user_permissions_for_resource: dict,
         # Skip combined resources
         if '&' in user_resource:
             continue
-        user_resource_identifier = ':'.join(user_resource.split(':')[:-1])
+        user_resource_identifier, _, user_resource_value = user_resource.rpartition(':')
         # Modify the identifier agent:group by agent:id in the user's resources
         if user_resource_identifier == 'agent:group':
             user_resource_identifier = 'agent:id'
-        wildcard_expansion = user_resource.split(':')[-1] == '*'
+        # Avoid the expansion if the resource is not required or if it is a deny over nothing allowed yet
+        if not req_resources.get(user_resource_identifier) or \
+                (user_resource_effect == 'deny' and not final_user_permissions.get(user_resource_identifier)):
+            continue
+        wildcard_expansion = user_resource_value == '*'
         expanded_resource = _expand_resource(user_resource)
         for value in req_resources.get(user_resource_identifier, list()):
             if wildcard_expansion and value != '*':
@@ -242,14 +288,15 @@ def _combination_processor(req_resources: list, user_permissions_for_resource: d
         # _combination_defined_rbac: This function prevents pairs from being treated individually
         if _combination_defined_rbac(req_resources, user_resource):
             split_user_resource = user_resource.split('&')
+            # The user's resources do not depend on the required ones, so they are expanded only once
+            expanded_user_resources = [(_expand_resource(r), r.endswith(':*')) for r in split_user_resource]
             for req_resource in req_resources:  # Normally this loop will iterate two times
-                for r, split_req_resource in zip(split_user_resource, req_resource.split('&')):
-                    split_chunk_resource = split_req_resource.split(':')
-                    identifier = ':'.join(split_chunk_resource[:-1])
-                    value = split_chunk_resource[-1]
-                    expanded_resource = _expand_resource(r)
-                    if r.split(':')[-1] == '*':
-                        expanded_resource |= _expand_resource(identifier + ':' + value)
+                for (expanded_user_resource, wildcard_expansion), split_req_resource in zip(expanded_user_resources,
+                                                                                            req_resource.split('&')):
+                    identifier, _, value = split_req_resource.rpartition(':')
+                    expanded_resource = expanded_user_resource
+                    if wildcard_expansion:
+                        expanded_resource = expanded_resource | _expand_resource(identifier + ':' + value)
                     _process_effect(user_resource_effect, identifier,
                                     value, final_user_permissions, expanded_resource)
 
@@ -280,6 +327,27 @@ def _match_permissions(req_permissions: dict = None, rbac_mode: str = 'white') -
     return allow_match
 
 
+@lru_cache(maxsize=None)
+def _parse_resource(resource: str) -> tuple:
+    """Get the identifier of an exposed resource and, if it is dynamic, the name of the kwarg holding its value.
+
+    Exposed resources are fixed in the decorators of the framework functions, so each one is only parsed once.
+
+    Parameters
+    ----------
+    resource : str
+        Exposed resource. Ex: "agent:id:{agent_list}" or "node:id:*"
+
+    Returns
+    -------
+    tuple
+        Resource identifier and name of the function kwarg holding the dynamic resources (None if the resource is
+        static).
+    """
+    m = _re_resource.match(resource)
+    return m.group(1), m.group(3)
+
+
 def _get_required_permissions(actions: list = None, resources: list = None, **kwargs: dict) -> tuple:
     """Resource pairs exposed by the framework function
 
@@ -307,14 +375,13 @@ def _get_required_permissions(actions: list = None, resources: list = None, **kw
         if len(split_resource) > 1:
             combination = True
         for r in split_resource:
-            m = re.search(r'^([a-z*]+:[a-z*]+):([^{\}]+|\*|{(\w+)})$', r)
-            res_base = m.group(1)
+            res_base, param_name = _parse_resource(r)
             # If we find a '{' in the regex we obtain the dynamic resource/s
-            if '{' in m.group(2):
-                target_params[m.group(1)] = m.group(3)
-                if m.group(3) in kwargs:
+            if param_name is not None:
+                target_params[res_base] = param_name
+                if param_name in kwargs:
                     # Dynamic resources ids are found within the {}
-                    params = kwargs[m.group(3)]
+                    params = kwargs[param_name]
                     if isinstance(params, list):
                         for param in params:
                             res_list.append("{0}:{1}".format(res_base, param))
@@ -333,7 +400,7 @@ def _get_required_permissions(actions: list = None, resources: list = None, **kw
                     res_list.append("{0}:{1}".format(res_base, params))
             # If we don't find a regex match we obtain the static resource/s
             else:
-                target_params[m.group(1)] = '*'
+                target_params[res_base] = '*'
                 add_denied = not broadcast.get()
                 res_list.append(r)
     # Create dict of required policies with action: list(resources) pairs
@@ -448,12 +515,20 @@ def expose_resources(actions: list = None, resources: list = None, post_proc_fun
     if post_proc_kwargs is None:
         post_proc_kwargs = dict()
 
+    # Static resources do not depend on the function kwargs, so their required permissions are only obtained once
+    static_permissions = _get_required_permissions(actions=actions, resources=resources) \
+        if resources and not any('{' in resource for resource in resources) else None
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             original_kwargs = dict(kwargs)
-            target_params, req_permissions, add_denied = \
-                _get_required_permissions(actions=actions, resources=resources, **kwargs)
+            if static_permissions is None:
+                target_params, req_permissions, add_denied = \
+                    _get_required_permissions(actions=actions, resources=resources, **kwargs)
+            else:
+                target_params, req_permissions, _ = static_permissions
+                add_denied = not broadcast.get()
             allow = _match_permissions(req_permissions=req_permissions, rbac_mode=rbac.get()['rbac_mode'])
             skip_execution = False
 
@@ -5,6 +5,7 @@
 import json
 import os
 import re
+from collections import defaultdict
 from unittest.mock import patch
 
 import pytest
@@ -127,3 +128,46 @@ def test_expose_resourcesless(db_setup, decorator_params, rbac, allowed, mode):
         except WazuhError as e:
             assert (not allowed)
             assert (e.code == 4000)
+
+
+@pytest.mark.parametrize('resource, expected', [
+    ('group:id:*', {'default', 'group1'}),
+    ('group:id:group1', {'group1'}),
+    ('node:id:*', {'master-node', 'worker1'}),
+    ('*:*:*', {'*'}),
+    ('unknown:id:*', set())
+])
+def test_expand_resource(db_setup, resource, expected):
+    """Check that the wildcard is expanded to the resources of the system depending on the resource type."""
+    db_setup.cluster_nodes.set(['master-node', 'worker1'])
+
+    with patch.dict(db_setup.wildcard_expansions, {'group:id': lambda: {'default', 'group1'}}):
+        assert db_setup._expand_resource(resource) == expected
+
+
+def test_single_processor_skips_expansion(db_setup):
+    """Check that resources which cannot change the final permissions are not expanded."""
+    final_user_permissions = defaultdict(set)
+    user_permissions = {'node:id:*': 'deny', 'group:id:*': 'allow', 'node:id:worker1': 'allow'}
+
+    with patch('wazuh.rbac.decorators._expand_resource', side_effect=lambda r: {r.rpartition(':')[2]}) as expand_mock:
+        db_setup._single_processor(['node:id:worker1'], user_permissions, final_user_permissions)
+
+    expand_mock.assert_called_once_with('node:id:worker1')
+    assert final_user_permissions == {'node:id': {'worker1'}}
+
+
+def test_expose_resources_static_permissions(db_setup):
+    """Check that the required permissions of static resources are only obtained once."""
+    db_setup.rbac.set({'rbac_mode': 'black'})
+
+    with patch('wazuh.rbac.decorators._expand_resource', return_value={'*'}), \
+            patch('wazuh.rbac.decorators._get_required_permissions',
+                  wraps=db_setup._get_required_permissions) as get_required_permissions_mock:
+        @db_setup.expose_resources(actions=['cluster:read'], resources=['node:id:*'], post_proc_func=None)
+        def framework_dummy():
+            return True
+
+        assert framework_dummy()
+        assert framework_dummy()
+        get_required_permissions_mock.assert_called_once_with(actions=['cluster:read'], resources=['node:id:*'])